@@ -1,15 +1,36 @@
 import streamlit as st
 import os
-from modules.rag_engine import load_and_split_pdfs, create_vector_store, get_rag_chain, query_rag
+import shutil
+from modules.rag_engine import VECTOR_STORE_DOCSTORE_FILE, vector_store_exists, load_and_split_pdfs, create_vector_store, get_rag_chain, query_rag_stream
 import modules.db_manager as db_manager
 
+UPLOAD_CHUNK_SIZE = 1 << 20
+# Characters of each source chunk shown in the UI and stored with the message
+SOURCE_SNIPPET_CHARS = 200
+
 st.set_page_config(page_title="RAG PDF Chat", layout="wide")
 
 st.title("📄 PDF Chat with RAG")
 
-# Initialize DB (Handles migration if needed)
+# Initialize DB (Handles migration if needed; runs once per process)
 db_manager.init_db()
 
+# --- Cached RAG Resources (shared across reruns and sessions) ---
+# Both caches are keyed by the index file's mtime, so a new upload invalidates them
+# without clearing anything; max_entries=1 drops the stale version.
+def _index_version():
+    # index.pkl is written last by save_local, so its mtime marks a complete save
+    return os.path.getmtime(VECTOR_STORE_DOCSTORE_FILE)
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _load_persistent_store(index_version):
+    return create_vector_store(None)
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _build_persistent_chain(index_version, _vectorstore):
+    # The leading underscore tells Streamlit not to hash the store
+    return get_rag_chain(_vectorstore)
+
 # --- Session Management Helper ---
 def select_session(session_id):
     st.session_state.current_session_id = session_id
@@ -18,47 +39,53 @@ def select_session(session_id):
     # (Optional: In this simple app, vector store is global or per-run, so we might want to keep it.)
     # For now, let's just reload messages.
 
-def create_new_session():
-    new_id = db_manager.create_session(f"Chat {len(db_manager.get_sessions()) + 1}")
+def refresh_sessions():
+    # The session list is cached in session_state and only re-queried after a mutation
+    st.session_state.sessions = db_manager.get_sessions()
+
+def create_new_session(chat_number):
+    new_id = db_manager.create_session(f"Chat {chat_number}")
+    refresh_sessions()
     select_session(new_id)
 
 def delete_session_btn(session_id):
     db_manager.delete_session(session_id)
+    refresh_sessions()
     # If deleted current session, switch to another or create new
     if st.session_state.current_session_id == session_id:
-        sessions = db_manager.get_sessions()
+        sessions = st.session_state.sessions
         if sessions:
             select_session(sessions[0]["id"])
         else:
-            create_new_session()
-    else:
+            create_new_session(1)
+        # The chat area now shows a different session
         st.rerun()
+    else:
+        # Only the session list changed
+        st.rerun(scope="fragment")
+
+if "sessions" not in st.session_state:
+    refresh_sessions()
+
+if not st.session_state.sessions:
+    # Create default session if none exist
+    create_new_session(1)
+
+# Ensure current_session_id is set
+if "current_session_id" not in st.session_state:
+    select_session(st.session_state.sessions[0]["id"])
 
 # --- Sidebar ---
-with st.sidebar:
-    st.header("Upload Document")
-    uploaded_files = st.file_uploader("Choose PDF files", type="pdf", accept_multiple_files=True)
-    
-    st.divider()
-    
+# Deleting an inactive session reruns only this fragment; creating, switching or
+# deleting the current session changes the chat area, so those rerun the whole app
+@st.fragment
+def session_list():
     st.header("Chat Sessions")
+    sessions = st.session_state.sessions
+    
     if st.button("➕ New Chat", use_container_width=True):
-        create_new_session()
+        create_new_session(len(sessions) + 1)
         st.rerun()
-    
-    # Load Sessions
-    sessions = db_manager.get_sessions()
-    if not sessions:
-        # Create default session if none exist
-        create_new_session()
-        sessions = db_manager.get_sessions()
-        
-    # Ensure current_session_id is set
-    if "current_session_id" not in st.session_state:
-        if sessions:
-            select_session(sessions[0]["id"])
-        else:
-            create_new_session()
 
     # Display Session List
     for sess in sessions:
@@ -74,43 +101,28 @@ with st.sidebar:
             
         if col2.button("🗑️", key=f"del_{sess['id']}_btn"):
             delete_session_btn(sess["id"])
-            st.rerun()
+
+with st.sidebar:
+    st.header("Upload Document")
+    # Kept outside the fragment: a new upload must rerun the whole script to be indexed
+    uploaded_files = st.file_uploader("Choose PDF files", type="pdf", accept_multiple_files=True)
+    
+    st.divider()
+    
+    session_list()
 
 # --- Main Chat Area ---
 
 # Initialize Vector Store (Persistent attempt)
 if "rag_chain" not in st.session_state:
-    if os.path.exists("./data/chroma_db"):
+    if vector_store_exists():
         with st.spinner("Loading persistent knowledge base..."):
-            vectorstore = create_vector_store(None)
+            index_version = _index_version()
+            vectorstore = _load_persistent_store(index_version)
             st.session_state.vectorstore = vectorstore
-            st.session_state.rag_chain = get_rag_chain(vectorstore)
+            st.session_state.rag_chain = _build_persistent_chain(index_version, vectorstore)
             st.toast("Loaded existing knowledge base!", icon="📚")
 
-# Display Chat History
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
-        # Display sources if available in metadata
-        if message.get("metadata") and "sources" in message["metadata"]:
-            with st.expander("📚 Sources"):
-                for idx, doc in enumerate(message["metadata"]["sources"]):
-                    # Handle both dict (from DB) and Document object (from memory before save) cases?
-                    # Actually, we should standardize. When saving, we convert to dict. 
-                    # When reading from DB, it's already dict.
-                    # Current code in app logic handles Document objects. We need to serialize them for DB.
-                    
-                    # If it's loaded from DB, it's a dict.
-                    source_name = doc.get("source", "Unknown file")
-                    page_num = doc.get("page", "Unknown page")
-                    content_snippet = doc.get("content", "")
-                    
-                    st.markdown(f"**Source {idx+1}**: {source_name} (Page {page_num})")
-                    st.text(content_snippet[:200] + "...")
-
 # Process Uploaded Files
 if uploaded_files:
     current_file_names = sorted([f.name for f in uploaded_files])
@@ -123,8 +135,10 @@ if uploaded_files:
             file_paths = []
             for uploaded_file in uploaded_files:
                 temp_file_path = os.path.join(temp_dir, uploaded_file.name)
+                # Copy in 1 MiB chunks instead of writing the whole buffer at once
+                uploaded_file.seek(0)
                 with open(temp_file_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
+                    shutil.copyfileobj(uploaded_file, f, UPLOAD_CHUNK_SIZE)
                 file_paths.append(temp_file_path)
             
             splits = load_and_split_pdfs(file_paths)
@@ -135,59 +149,89 @@ if uploaded_files:
             
             st.success(f"Processed {len(uploaded_files)} PDF(s)! You can now ask questions.")
 
-# Chat Input
-if prompt := st.chat_input("Ask a question about the PDF..."):
-    # User message
-    st.session_state.messages.append({"role": "user", "content": prompt})
-    with st.chat_message("user"):
-        st.markdown(prompt)
+if "messages" not in st.session_state:
+    st.session_state.messages = []
+
+# Sending a message only reruns this fragment instead of the whole script
+@st.fragment
+def chat_area():
+    # Display Chat History
+    for message in st.session_state.messages:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+            # Display sources if available in metadata
+            if message.get("metadata") and "sources" in message["metadata"]:
+                with st.expander("📚 Sources"):
+                    for idx, doc in enumerate(message["metadata"]["sources"]):
+                        # Handle both dict (from DB) and Document object (from memory before save) cases?
+                        # Actually, we should standardize. When saving, we convert to dict. 
+                        # When reading from DB, it's already dict.
+                        # Current code in app logic handles Document objects. We need to serialize them for DB.
+                    
+                        # If it's loaded from DB, it's a dict.
+                        source_name = doc.get("source", "Unknown file")
+                        page_num = doc.get("page", "Unknown page")
+                        content_snippet = doc.get("content", "")
+                    
+                        st.markdown(f"**Source {idx+1}**: {source_name} (Page {page_num})")
+                        st.text(content_snippet[:SOURCE_SNIPPET_CHARS] + "...")
+
+    # Chat Input
+    if prompt := st.chat_input("Ask a question about the PDF..."):
+        # User message
+        user_msg = {"role": "user", "content": prompt}
+        st.session_state.messages.append(user_msg)
+        with st.chat_message("user"):
+            st.markdown(prompt)
     
-    # Save user message
-    db_manager.save_message(st.session_state.current_session_id, "user", prompt)
-
-    # Generate Response
-    if "rag_chain" in st.session_state:
-        with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                # Prepare history for RAG (last 5 messages to avoid blowing context)
-                history_tuples = [(msg["role"], msg["content"]) for msg in st.session_state.messages[-6:-1]]
+        # Buffer the user message so it is saved together with the reply in one transaction
+        pending_messages = [user_msg]
+
+        try:
+            # Generate Response
+            if "rag_chain" in st.session_state:
+                with st.chat_message("assistant"):
+                    with st.spinner("Thinking..."):
+                        # Prepare history for RAG (last 5 messages to avoid blowing context)
+                        history_tuples = [(msg["role"], msg["content"]) for msg in st.session_state.messages[-6:-1]]
                 
-                response = query_rag(st.session_state.rag_chain, prompt, history=history_tuples)
-                answer = response["answer"]
-                st.markdown(answer)
+                        # Stream tokens to the UI as they arrive; write_stream returns the full answer
+                        sources = []
+                        answer = st.write_stream(
+                            query_rag_stream(st.session_state.rag_chain, prompt, history=history_tuples, sources=sources)
+                        )
                 
-                sources_data = []
-                if "sources" in response and response["sources"]:
-                    with st.expander("📚 Sources"):
-                        for idx, doc in enumerate(response["sources"]):
-                            # 'doc' is a Document object here.
-                            source_name = doc.metadata.get("source", "Unknown file")
-                            page_num = doc.metadata.get("page", "Unknown page")
-                            st.markdown(f"**Source {idx+1}**: {source_name} (Page {page_num})")
-                            st.text(doc.page_content[:200] + "...")
+                        sources_data = []
+                        if sources:
+                            with st.expander("📚 Sources"):
+                                for idx, doc in enumerate(sources):
+                                    # 'doc' is a Document object here.
+                                    source_name = doc.metadata.get("source", "Unknown file")
+                                    page_num = doc.metadata.get("page", "Unknown page")
+                                    st.markdown(f"**Source {idx+1}**: {source_name} (Page {page_num})")
+                                    st.text(doc.page_content[:SOURCE_SNIPPET_CHARS] + "...")
                             
-                            # Prepare for DB storage
-                            sources_data.append({
-                                "source": source_name,
-                                "page": page_num,
-                                "content": doc.page_content
-                            })
-        
-        # Assistant message object
-        assistant_msg = {
-            "role": "assistant", 
-            "content": answer,
-            "metadata": {"sources": sources_data}
-        }
-        st.session_state.messages.append(assistant_msg)
+                                    # Prepare for DB storage
+                                    sources_data.append({
+                                        "source": source_name,
+                                        "page": page_num,
+                                        "content": doc.page_content[:SOURCE_SNIPPET_CHARS],
+                                        "chunk_id": doc.metadata.get("chunk_id")
+                                    })
         
-        # Save assistant message
-        db_manager.save_message(
-            st.session_state.current_session_id, 
-            "assistant", 
-            answer, 
-            metadata={"sources": sources_data}
-        )
+                # Assistant message object
+                assistant_msg = {
+                    "role": "assistant", 
+                    "content": answer,
+                    "metadata": {"sources": sources_data}
+                }
+                st.session_state.messages.append(assistant_msg)
+                pending_messages.append(assistant_msg)
             
-    else:
-        st.error("Please upload PDF files or ensure the knowledge base is loaded.")
+            else:
+                st.error("Please upload PDF files or ensure the knowledge base is loaded.")
+        finally:
+            # Save the buffered messages even if generation fails, so the question is never lost
+            db_manager.save_messages(st.session_state.current_session_id, pending_messages)
+
+chat_area()
@@ -0,0 +1,26 @@
+import os
+import chromadb
+from modules.rag_engine import VECTOR_STORE_DIR, create_vector_store
+
+# One-off migration of the old Chroma store into the FAISS index.
+# Reuses the stored vectors, so no embedding API calls are made.
+CHROMA_DIR = "./chroma_db"
+COLLECTION_NAME = "langchain" # Default collection used by langchain-chroma
+
+if not os.path.exists(CHROMA_DIR):
+    print("No Chroma store to migrate.")
+else:
+    client = chromadb.PersistentClient(path=CHROMA_DIR)
+    collection = client.get_collection(COLLECTION_NAME)
+    data = collection.get(include=["embeddings", "documents", "metadatas"])
+    print(f"Migrating {len(data['ids'])} chunks from {CHROMA_DIR} to {VECTOR_STORE_DIR}...")
+
+    vectorstore = create_vector_store(None)
+    # Keeping Chroma's ids makes a second run fail instead of duplicating chunks
+    vectorstore.add_embeddings(
+        list(zip(data["documents"], data["embeddings"])),
+        metadatas=data["metadatas"],
+        ids=data["ids"]
+    )
+    vectorstore.save_local(VECTOR_STORE_DIR)
+    print("Migration complete. ./chroma_db can be deleted once the app works with the new index.")
@@ -1,167 +1,190 @@
 import sqlite3
 import os
-import json
+import threading
+from functools import lru_cache
+import orjson
 from datetime import datetime
 
 DB_FILE = "data/chat_history.db"
 
+# One shared connection for the whole process (autocommit), serialized by a lock
+os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
+_conn = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None)
+_lock = threading.Lock()
+_conn.execute("PRAGMA journal_mode=WAL")
+_conn.execute("PRAGMA synchronous=NORMAL")
+_conn.execute("PRAGMA temp_store=MEMORY")
+
+# Bump when init_db gains a new migration step
+SCHEMA_VERSION = 1
+
+# Set once init_db has run, so Streamlit reruns don't repeat the schema checks
+_initialized = False
+
+@lru_cache(maxsize=2048)
+def _parse_meta(text: str):
+    """Parse a metadata JSON string, memoized on the raw text. The returned dict is shared; don't mutate it."""
+    return orjson.loads(text)
+
 def init_db():
-    """Initialize the SQLite database and perform migrations if necessary."""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # 1. Create sessions table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS sessions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # 2. Check if messages table exists and has the correct schema
-    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='messages'")
-    messages_exists = c.fetchone()
-    
-    needs_migration = False
-    if messages_exists:
-        # Check columns
-        c.execute("PRAGMA table_info(messages)")
-        columns = [info[1] for info in c.fetchall()]
-        if "session_id" not in columns or "metadata" not in columns:
-            needs_migration = True
-    
-    if needs_migration:
-        print("Migrating database schema...")
-        # Rename old table
-        c.execute("ALTER TABLE messages RENAME TO messages_old")
-        
-        # Create new table
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id INTEGER,
-                role TEXT NOT NULL,
-                content TEXT NOT NULL,
-                metadata TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(session_id) REFERENCES sessions(id)
-            )
-        ''')
-        
-        # Create a legacy session for old messages
-        c.execute("INSERT INTO sessions (title) VALUES (?)", ("Legacy Session",))
-        legacy_session_id = c.lastrowid
-        
-        # Migrate old messages
-        c.execute("SELECT role, content, timestamp FROM messages_old")
-        old_messages = c.fetchall()
-        
-        for role, content, timestamp in old_messages:
+    """Initialize the SQLite database and perform migrations if necessary (once per process)."""
+    global _initialized
+    # Run schema creation and migration as a single transaction (rolled back on error)
+    with _lock, _conn:
+        if _initialized:
+            return
+        c = _conn.cursor()
+        # Schema checks only run when the database is older than SCHEMA_VERSION
+        version = c.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION:
+            c.execute("BEGIN")
+
+            # 1. Create sessions table
             c.execute('''
-                INSERT INTO messages (session_id, role, content, timestamp)
-                VALUES (?, ?, ?, ?)
-            ''', (legacy_session_id, role, content, timestamp))
-            
-        # Optional: Drop old table or keep for backup. Keeping for safety.
-        # c.execute("DROP TABLE messages_old") 
-        print(f"Migration complete. {len(old_messages)} messages moved to Legacy Session.")
-        
-    else:
-        # Create table if it doesn't exist at all
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id INTEGER,
-                role TEXT NOT NULL,
-                content TEXT NOT NULL,
-                metadata TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(session_id) REFERENCES sessions(id)
-            )
-        ''')
-        
-    conn.commit()
-    conn.close()
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    title TEXT NOT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # 2. Check if messages table exists and has the correct schema
+            c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='messages'")
+            messages_exists = c.fetchone()
+
+            needs_migration = False
+            if messages_exists:
+                # Check columns
+                c.execute("PRAGMA table_info(messages)")
+                columns = [info[1] for info in c.fetchall()]
+                if "session_id" not in columns or "metadata" not in columns:
+                    needs_migration = True
+
+            if needs_migration:
+                print("Migrating database schema...")
+                # Rename old table
+                c.execute("ALTER TABLE messages RENAME TO messages_old")
+
+                # Create new table
+                c.execute('''
+                    CREATE TABLE IF NOT EXISTS messages (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        session_id INTEGER,
+                        role TEXT NOT NULL,
+                        content TEXT NOT NULL,
+                        metadata TEXT,
+                        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY(session_id) REFERENCES sessions(id)
+                    )
+                ''')
+
+                # Create a legacy session for old messages
+                c.execute("INSERT INTO sessions (title) VALUES (?)", ("Legacy Session",))
+                legacy_session_id = c.lastrowid
+
+                # Migrate old messages
+                c.execute("SELECT role, content, timestamp FROM messages_old")
+                old_messages = c.fetchall()
+
+                c.executemany('''
+                    INSERT INTO messages (session_id, role, content, timestamp)
+                    VALUES (?, ?, ?, ?)
+                ''', [(legacy_session_id, role, content, timestamp) for role, content, timestamp in old_messages])
+
+                # Optional: Drop old table or keep for backup. Keeping for safety.
+                # c.execute("DROP TABLE messages_old")
+                print(f"Migration complete. {len(old_messages)} messages moved to Legacy Session.")
+
+            else:
+                # Create table if it doesn't exist at all
+                c.execute('''
+                    CREATE TABLE IF NOT EXISTS messages (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        session_id INTEGER,
+                        role TEXT NOT NULL,
+                        content TEXT NOT NULL,
+                        metadata TEXT,
+                        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY(session_id) REFERENCES sessions(id)
+                    )
+                ''')
+
+            # Speeds up load_history (filter by session, order by time)
+            c.execute("CREATE INDEX IF NOT EXISTS idx_msg_session_ts ON messages(session_id, timestamp)")
+            c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        _initialized = True
 
 def create_session(title: str = "New Chat"):
     """Create a new chat session."""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("INSERT INTO sessions (title) VALUES (?)", (title,))
-    session_id = c.lastrowid
-    conn.commit()
-    conn.close()
+    with _lock:
+        c = _conn.execute("INSERT INTO sessions (title) VALUES (?)", (title,))
+        session_id = c.lastrowid
     return session_id
 
 def get_sessions():
     """Get all sessions ordered by creation time (newest first)."""
-    if not os.path.exists(DB_FILE):
-        return []
-    
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT id, title, created_at FROM sessions ORDER BY created_at DESC")
-    rows = c.fetchall()
-    conn.close()
-    
+    with _lock:
+        rows = _conn.execute("SELECT id, title, created_at FROM sessions ORDER BY created_at DESC").fetchall()
+
     return [{"id": row[0], "title": row[1], "created_at": row[2]} for row in rows]
 
 def delete_session(session_id: int):
     """Delete a session and all its messages."""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
-    c.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
-    conn.commit()
-    conn.close()
+    # Both deletes share one transaction
+    with _lock, _conn:
+        _conn.execute("BEGIN")
+        _conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        _conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
 
 def save_message(session_id: int, role: str, content: str, metadata: dict = None):
     """Save a new message to the database."""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    metadata_json = json.dumps(metadata) if metadata else None
-    
-    c.execute('''
-        INSERT INTO messages (session_id, role, content, metadata) 
-        VALUES (?, ?, ?, ?)
-    ''', (session_id, role, content, metadata_json))
-    
-    conn.commit()
-    conn.close()
+    metadata_json = orjson.dumps(metadata).decode() if metadata else None
+
+    with _lock:
+        _conn.execute('''
+            INSERT INTO messages (session_id, role, content, metadata)
+            VALUES (?, ?, ?, ?)
+        ''', (session_id, role, content, metadata_json))
+
+def save_messages(session_id: int, messages: list):
+    """Save several messages (dicts with role, content and optional metadata) in one transaction."""
+    rows = [
+        (session_id, msg["role"], msg["content"], orjson.dumps(msg["metadata"]).decode() if msg.get("metadata") else None)
+        for msg in messages
+    ]
+
+    with _lock, _conn:
+        _conn.execute("BEGIN")
+        _conn.executemany('''
+            INSERT INTO messages (session_id, role, content, metadata)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
 
 def load_history(session_id: int):
     """Load messages for a specific session."""
-    if not os.path.exists(DB_FILE):
-        return []
-    
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''
-        SELECT role, content, metadata 
-        FROM messages 
-        WHERE session_id = ? 
-        ORDER BY timestamp ASC
-    ''', (session_id,))
-    rows = c.fetchall()
-    conn.close()
-    
+    with _lock:
+        rows = _conn.execute('''
+            SELECT role, content, metadata
+            FROM messages
+            WHERE session_id = ?
+            ORDER BY timestamp ASC, id ASC
+        ''', (session_id,)).fetchall()
+
     messages = []
     for row in rows:
         msg = {
-            "role": row[0], 
+            "role": row[0],
             "content": row[1]
         }
         if row[2]:
             try:
-                msg["metadata"] = json.loads(row[2])
+                msg["metadata"] = _parse_meta(row[2])
             except:
                 msg["metadata"] = None
         else:
             msg["metadata"] = None
         messages.append(msg)
-        
+
     return messages
 
 if __name__ == "__main__":
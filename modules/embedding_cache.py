@@ -0,0 +1,59 @@
+import os
+import hashlib
+import tempfile
+from functools import lru_cache
+from array import array
+from langchain_core.embeddings import Embeddings
+
+CACHE_DIR = "./data/emb_cache"
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that persists document vectors on disk, keyed by SHA-256 of namespace + text.
+
+    Query vectors are kept in an in-memory LRU so repeated questions skip the API round-trip.
+    """
+
+    def __init__(self, underlying: Embeddings, namespace: str, cache_dir: str = CACHE_DIR, query_cache_size: int = 1024):
+        self.underlying = underlying
+        self.namespace = namespace
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        # Tuples are immutable, so callers can't corrupt a cached vector
+        self._embed_query_cached = lru_cache(maxsize=query_cache_size)(
+            lambda text: tuple(self.underlying.embed_query(text))
+        )
+
+    def _path(self, text: str):
+        key = hashlib.sha256(f"{self.namespace}\0{text}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key)
+
+    def _load(self, text: str):
+        try:
+            with open(self._path(text), "rb") as f:
+                vector = array("f")
+                vector.frombytes(f.read())
+                return vector.tolist()
+        except FileNotFoundError:
+            return None
+
+    def _store(self, text: str, vector):
+        # Write to a uniquely named temp file first, so a crash or a concurrent writer
+        # never leaves a truncated vector behind
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".tmp", delete=False) as f:
+            f.write(array("f", vector).tobytes())
+        os.replace(f.name, self._path(text))
+
+    def embed_documents(self, texts):
+        """Embed documents, only calling the underlying model for cache misses."""
+        vectors = [self._load(text) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            new_vectors = self.underlying.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, new_vectors):
+                self._store(texts[i], vector)
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text):
+        """Embed a query, reusing the vector for recently seen query text."""
+        return list(self._embed_query_cached(text))
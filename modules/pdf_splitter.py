@@ -0,0 +1,60 @@
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+import pymupdf
+import tiktoken
+from langchain_core.documents import Document
+
+# Kept free of API clients and vector store imports: process pool workers import this module.
+
+# Chunk size/overlap in gpt-4o tokens (roughly 1000/200 characters)
+CHUNK_SIZE_TOKENS = 256
+CHUNK_OVERLAP_TOKENS = 50
+
+@lru_cache(maxsize=None)
+def _get_encoding():
+    return tiktoken.encoding_for_model("gpt-4o")
+
+def _split_page(page, encoding):
+    """Splits one page into overlapping token windows, tokenizing its text only once."""
+    tokens = encoding.encode(page.page_content, disallowed_special=())
+    if not tokens:
+        return []
+    # Character offset where each token starts, from the same token array
+    text, offsets = encoding.decode_with_offsets(tokens)
+    n = len(tokens)
+    # Token indices that start with whitespace are preferred cut points
+    boundaries = [i for i in range(1, n) if text[offsets[i]:offsets[i] + 1].isspace()]
+
+    chunks = []
+    start = 0
+    while True:
+        end = min(start + CHUNK_SIZE_TOKENS, n)
+        if end < n:
+            # Binary search for the last boundary inside the window
+            k = bisect_right(boundaries, end) - 1
+            if k >= 0 and boundaries[k] > start + CHUNK_OVERLAP_TOKENS:
+                end = boundaries[k]
+        chunk_text = text[offsets[start]:offsets[end] if end < n else len(text)].strip()
+        if chunk_text:
+            # Stable id (source:page:index) so stored citations can refer back to the chunk
+            chunk_id = f"{page.metadata.get('source')}:{page.metadata.get('page')}:{len(chunks)}"
+            chunks.append(Document(page_content=chunk_text, metadata={**page.metadata, "chunk_id": chunk_id}))
+        if end == n:
+            return chunks
+        # Step back by the overlap, snapped forward to the next boundary
+        next_start = end - CHUNK_OVERLAP_TOKENS
+        k = bisect_left(boundaries, next_start)
+        if k < len(boundaries) and boundaries[k] < end:
+            next_start = boundaries[k]
+        start = next_start
+
+def load_split_pdf(file_path):
+    """Loads a single PDF and splits it into chunks (runs in a worker process)."""
+    # PyMuPDF extracts text in C, much faster than pypdf's pure-Python parser
+    with pymupdf.open(file_path) as pdf:
+        docs = [
+            Document(page_content=page.get_text("text"), metadata={"source": file_path, "page": i})
+            for i, page in enumerate(pdf)
+        ]
+    encoding = _get_encoding()
+    return [chunk for doc in docs for chunk in _split_page(doc, encoding)]
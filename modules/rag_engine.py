@@ -1,13 +1,14 @@
 import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 # from langchain.chains.combine_documents import create_stuff_documents_chain # Removed due to import error
-# from langchain_community.vectorstores import Chroma # Removed
 import os
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.documents import Document
+from modules.embedding_cache import CachedEmbeddings
+from modules.pdf_splitter import load_split_pdf
 
 load_dotenv()
 
@@ -16,45 +17,75 @@ embeddings = OpenAIEmbeddings(
     api_key=os.getenv("OPENAI_API_KEY") # Automatically read from env
 )
 
+# Reuse stored vectors for chunks that were already embedded (survives restarts)
+cached_embeddings = CachedEmbeddings(embeddings, namespace=embeddings.model)
+
 # Initialize LLM
 llm = ChatOpenAI(model="gpt-4o", temperature=0)
 
 def load_and_split_pdfs(file_paths):
-    """Loads multiple PDFs and splits them into chunks."""
-    all_docs = []
-    for file_path in file_paths:
-        loader = PyPDFLoader(file_path)
-        docs = loader.load()
-        all_docs.extend(docs)
-    
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200
-    )
-    splits = text_splitter.split_documents(all_docs)
+    """Loads multiple PDFs and splits them into chunks, one worker process per file."""
+    if not file_paths:
+        return []
+    if len(file_paths) == 1:
+        # Not worth the cost of starting a worker process
+        return load_split_pdf(file_paths[0])
+
+    # Splitting is pure-Python CPU work, so use processes to bypass the GIL.
+    # Spawn (not fork) so workers don't copy the running multi-threaded Streamlit server.
+    max_workers = min(len(file_paths), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        # Workers only import the lightweight pdf_splitter module, not this one
+        results = executor.map(load_split_pdf, file_paths)
+        splits = [split for file_splits in results for split in file_splits]
     return splits
 
-from langchain_chroma import Chroma
+import faiss
+from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+
+VECTOR_STORE_DIR = "./data/faiss_index"
+# save_local writes index.faiss then index.pkl; the store is only usable once both exist
+VECTOR_STORE_INDEX_FILE = os.path.join(VECTOR_STORE_DIR, "index.faiss")
+VECTOR_STORE_DOCSTORE_FILE = os.path.join(VECTOR_STORE_DIR, "index.pkl")
+
+def vector_store_exists():
+    """Returns True if a complete FAISS index has been saved to VECTOR_STORE_DIR."""
+    return os.path.isfile(VECTOR_STORE_INDEX_FILE) and os.path.isfile(VECTOR_STORE_DOCSTORE_FILE)
+
+# Dimension of the OpenAI embedding vectors
+EMBEDDING_DIM = 1536
 
 def create_vector_store(splits):
-    """Creates a persistent Chroma vector store from document splits."""
-    if not splits:
-        # If no splits, try to load existing DB
-        return Chroma(
-            persist_directory="./chroma_db", 
-            embedding_function=embeddings
+    """Creates (or extends) a persistent FAISS vector store from document splits."""
+    # Open the existing index once (or create an empty one), then add all documents
+    if vector_store_exists():
+        # The index was written by this app, so unpickling the docstore is safe
+        vectorstore = FAISS.load_local(
+            VECTOR_STORE_DIR,
+            cached_embeddings,
+            allow_dangerous_deserialization=True
         )
+    else:
+        vectorstore = FAISS(
+            embedding_function=cached_embeddings,
+            # Store vectors as float16: half the size of float32 with negligible recall loss
+            index=faiss.IndexScalarQuantizer(EMBEDDING_DIM, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2),
+            docstore=InMemoryDocstore(),
+            index_to_docstore_id={}
+        )
+    if not splits:
+        # If no splits, just return the existing DB
+        return vectorstore
 
-    # Create/Update vector store
-    vectorstore = Chroma.from_documents(
-        documents=splits,
-        embedding=embeddings,
-        persist_directory="./chroma_db"
-    )
+    # Create/Update vector store in one call; OpenAIEmbeddings already sends
+    # up to 1000 texts per API request, so smaller batches would add requests
+    vectorstore.add_documents(splits)
+    vectorstore.save_local(VECTOR_STORE_DIR)
     return vectorstore
 
 # from langchain.chains import create_retrieval_chain # Removed due to import error
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnablePassthrough, RunnableBranch
 from operator import itemgetter
 
 def get_rag_chain(vectorstore):
@@ -102,7 +133,10 @@ def get_rag_chain(vectorstore):
         ]
     )
     
-    history_aware_retriever = (
+    # Only rephrase the question when there is history to resolve references against;
+    # on the first turn the question is already standalone, so skip the extra LLM call
+    history_aware_retriever = RunnableBranch(
+        (lambda x: not x.get("chat_history"), itemgetter("input") | retriever),
         contextualize_q_prompt
         | llm
         | (lambda x: x.content) # Output parser for just content
@@ -121,11 +155,7 @@ def get_rag_chain(vectorstore):
         ]
     )
 
-    # We need to decide whether to use history_aware_retriever or normal retriever
-    # This is a bit tricky with simple LCEL. 
-    # Let's just always use the rephrasing step if we are supporting history, 
-    # but efficiently, we only really need it if history is not empty.
-    # For simplicity, we will built the chain to always accept 'chat_history'.
+    # The chain always accepts 'chat_history'; history_aware_retriever decides whether to rephrase.
 
     from langchain_core.runnables import RunnableLambda, RunnableParallel
 
@@ -146,17 +176,16 @@ def get_rag_chain(vectorstore):
     )
     return rag_chain_with_source
 
-def query_rag(chain, question, history=[]):
-    """Queries the RAG chain and returns the answer and sources."""
-    response = chain.invoke({"input": question, "chat_history": history})
-    
-    # response is now a dict with 'context' (docs) and 'answer' (AIMessage)
-    answer_text = response["answer"].content if hasattr(response["answer"], "content") else str(response["answer"])
-    
-    return {
-        "answer": answer_text,
-        "sources": response["context"]
-    }
+def query_rag_stream(chain, question, history=[], sources=None):
+    """Streams the answer text from the RAG chain as it is generated.
+
+    If a list is passed as `sources`, the retrieved documents are appended to it.
+    """
+    for chunk in chain.stream({"input": question, "chat_history": history}):
+        if "context" in chunk and sources is not None:
+            sources.extend(chunk["context"])
+        if "answer" in chunk:
+            yield chunk["answer"].content
 
 if __name__ == "__main__":
     # Test block